@@ -2,6 +2,7 @@
 Relevant Python documentation
 - https://docs.python.org/3/library/subprocess.html
 - https://docs.python.org/3/library/xml.etree.elementtree.html
+- https://lxml.de/tutorial.html
 
 Useful links
 - running Java code from CLI
@@ -35,12 +36,24 @@ ElementTree tips
 import argparse
 import copy
 import json
+import logging
 import os.path
 import random
+import re
 import string
 import subprocess
-import xml.etree.ElementTree as ET
+# lxml if available, else ElementTree
+try:
+	from lxml import etree as ET
+	LXML = True
+except ImportError:
+	import xml.etree.ElementTree as ET
+	LXML = False
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat, takewhile
 from subprocess import Popen, PIPE, run
+from types import SimpleNamespace
 
 notationtypes = {'FLT': 'tab.lute.french',
 				 'ILT': 'tab.lute.italian',
@@ -55,6 +68,8 @@ tunings = {'F' : [('f', 4), ('c', 4), ('g', 3), ('eb', 3), ('bb', 2), ('f', 2)],
 		   'A-': [('a', 4), ('e', 4), ('b', 3), ('g', 3), ('d', 3), ('g', 2)]
 		  }
 shift_intervals = {'F': -2, 'G': 0, 'A': 2}
+# str()s of small ints (attribute values, Java args)
+small_int_strs = {i: str(i) for i in range(-1, 128)}
 smufl_lute_durs = {'f': 'fermataAbove',
 				   1: 'luteDurationDoubleWhole',
 				   2: 'luteDurationWhole',
@@ -64,6 +79,8 @@ smufl_lute_durs = {'f': 'fermataAbove',
 				   32: 'luteDuration16th',
 				   '.': 'augmentationDot'
 				  }
+# smufl_lute_durs keyed by the str value of @dur (or 'f' for a fermata)
+smufl_lute_durs_by_dur = {str(k): v for k, v in smufl_lute_durs.items() if k != '.'}
 #cp_dirs = [
 #		   'formats/lib/*',
 #		   'formats/bin/',
@@ -100,12 +117,26 @@ smufl_lute_durs = {'f': 'fermataAbove',
 #cp = (':' if os.name == 'posix' else ';').join(cp_dirs)
 
 java_path = 'tools.music.PitchKeyTools' # <package>.<package>.<file>
+# JVM options for a fast start-up: C1 (client) JIT compiler only, serial GC
+java_opts = ['-XX:TieredStopAtLevel=1', '-XX:+UseSerialGC']
 verbose = False
 add_accid_ges = True
 
-xml_ids = []
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG if verbose else logging.WARNING)
+
+xml_ids = set()
 LEN_ID = 8
 
+# The prolog: any BOM and the <?xml> declaration, followed by any <?xml-model> PIs 
+# (each group includes the whitespace following it)
+prolog_pattern = re.compile(r'(\ufeff?(?:<\?xml\s[^>]*\?>\s*)?)((?:<\?xml-model\s[^>]*\?>\s*)*)')
+
+executor = None # ProcessPoolExecutor for batches of files; see _get_executor()
+
+# The Clark-notation tags ('{uri}name') of the MEI elements used; see _init_tags()
+mei_tags = SimpleNamespace()
+
 # Vals for args.mode
 MINOR = '1'
 MAJOR = '0'
@@ -124,23 +155,23 @@ GLT = 'GLT'
 
 def _add_unique_id(prefix, arg_xml_ids):
 	"""
-	Generates a unique ID with the given prefix and adds it to given list.
+	Generates a unique ID with the given prefix and adds it to given set.
 
 	Args:
 		prefix (str): The prefix for the ID.
-		arg_xml_ids (list): The list of existing IDs.
+		arg_xml_ids (set): The set of existing IDs.
 
 	Returns:
-		list: The updated list of IDs.
+		str: The new ID.
 	"""
 	while True:
 		rand_id = ''.join(random.choices(string.ascii_letters + string.digits, k=(LEN_ID - len(prefix))))
 		xml_id = prefix + rand_id
 		if xml_id not in arg_xml_ids:
-			arg_xml_ids.append(xml_id)
+			arg_xml_ids.add(xml_id)
 			break
 
-	return arg_xml_ids
+	return xml_id
 
 
 def _create_element(name: str, parent: ET.Element=None, atts: list=[]): # -> ET.Element:
@@ -157,22 +188,77 @@ def _create_element(name: str, parent: ET.Element=None, atts: list=[]): # -> ET.
 	se = ET.SubElement(parent, name, att_1='<val_1>', att_2='<val_2>', ..., att_n='<val_n>')
 	se.set('<att_with_dot>', '<val>')
 	"""
-	o = ET.Element(name) if parent == None else ET.SubElement(parent, name)
-	for a in atts:
-		o.set(a[0], a[1])
+	attrib = dict(atts)
+	o = ET.Element(name, attrib) if parent is None else ET.SubElement(parent, name, attrib)
 
 	return o
 
 
-def handle_namespaces(path: str): # -> dict
+@lru_cache(maxsize=None)
+def _compile_path(path: str, uri_mei: str): # -> Callable
+	"""
+	Returns a callable that takes an element and returns the list of elements matching 
+	the given path, in which the prefix 'mei' stands for uri_mei. With lxml, the path is 
+	compiled into an XPath object; with ElementTree, findall() is used. 
+	"""
+	namespaces = {'mei': uri_mei}
+	if LXML:
+		return ET.XPath(path, namespaces=namespaces, smart_strings=False)
+	else:
+		return lambda elem: elem.findall(path, namespaces)
+
+
+def _clone_element(elem: ET.Element, xml_id_key: str, prefix: str): # -> ET.Element:
+	"""
+	Copies the given element, including its subtree, and gives the copy a new xml:id with 
+	the given prefix. Any descendants with an xml:id also get a new one (prefixed with the 
+	first letter of their tag name), so that the copy does not duplicate any IDs.
+	"""
+	# lxml: deepcopy(); ElementTree: rebuild the subtree
+	if LXML:
+		clone = copy.deepcopy(elem)
+	else:
+		def _copy(e):
+			c = ET.Element(e.tag, e.attrib)
+			c.text, c.tail = e.text, e.tail
+			c.extend(_copy(child) for child in e)
+			return c
+		clone = _copy(elem)
+
+	clone.set(xml_id_key, _add_unique_id(prefix, xml_ids))
+	for e in clone.iter():
+		if e is not clone and xml_id_key in e.attrib:
+			e.set(xml_id_key, _add_unique_id(_local_name(e.tag)[0], xml_ids))
+
+	return clone
+
+
+@lru_cache(maxsize=256)
+def _local_name(tag: str): # -> str
+	# The tag without its '{uri}' prefix
+	return tag.split('}', 1)[1] if '}' in tag else tag
+
+
+def _init_tags(uri_mei: str): # -> None
+	# Called by the handle_*() functions with the namespace they are given
+	for name in ['measure', 'staff', 'layer', 'tabGrp', 'tabDurSym', 'note', 'rest', 
+				 'chord', 'space', 'fermata', 'annot', 'fing', 'dir', 'symbol', 
+				 'staffGrp', 'staffDef', 'clef', 'keySig', 'course']:
+		setattr(mei_tags, name, f'{{{uri_mei}}}{name}')
+
+
+def handle_namespaces(ns_nodes: list): # -> dict
 	# There is only one namespace, whose key is an empty string -- replace the  
 	# key with something meaningful ('mei'). See
 	# https://stackoverflow.com/questions/42320779/get-the-namespaces-from-xml-with-python-elementtree/42372404#42372404
 	# To avoid an 'ns0' prefix before each tag, register the namespace as an empty string. See
 	# https://stackoverflow.com/questions/8983041/saving-xml-files-using-elementtree
-	ns = dict([node for _, node in ET.iterparse(path, events=['start-ns'])])
+	# NB lxml keeps the prefixes of the parsed document (and does not accept an 
+	#    empty prefix here), so this is only needed with ElementTree
+	ns = dict(ns_nodes)
 	ns['mei'] = ns.pop('')
-	ET.register_namespace('', ns['mei'])
+	if not LXML:
+		ET.register_namespace('', ns['mei'])
 	ns['xml'] = 'http://www.w3.org/XML/1998/namespace'
 
 	return ns
@@ -193,10 +279,15 @@ def parse_tree(path: str): # -> Tuple
 	  </music>
 	</mei>   
 	"""
-	tree = ET.parse(path)
-	root = tree.getroot()
+	# Parse; collect the namespace declarations (as (prefix, uri) tuples) 
+	# NB Like ElementTree's parser, lxml's must drop comments and PIs
+	kwargs = {'remove_comments': True, 'remove_pis': True} if LXML else {}
+	context = ET.iterparse(path, events=['start-ns'], **kwargs)
+	ns_nodes = [node for _, node in context]
+	root = context.root
+	tree = ET.ElementTree(root)
 
-	return (tree, root)
+	return (tree, root, ns_nodes)
 
 
 def handle_scoreDef(scoreDef: ET.Element, ns: dict, args: argparse.Namespace): # -> None
@@ -217,9 +308,9 @@ def handle_scoreDef(scoreDef: ET.Element, ns: dict, args: argparse.Namespace): #
 	of a single staff, otherwise two; the lower <staffDef> is for the tablature. 
 	"""
 
-	uri_mei = f'{{{ns['mei']}}}'
 	uri_xml = f'{{{ns['xml']}}}'
 	xml_id_key = f'{uri_xml}id'
+	_init_tags(ns['mei'])
 
 	staffGrp = scoreDef.find('mei:staffGrp', ns)
 
@@ -241,10 +332,10 @@ def handle_scoreDef(scoreDef: ET.Element, ns: dict, args: argparse.Namespace): #
 			tab_staffDef.set('notationtype', notationtypes[args.type])
 		# Reset <tuning>	
 		tuning.clear()
-		tuning.set(xml_id_key, _add_unique_id('t', xml_ids)[-1])
+		tuning.set(xml_id_key, _add_unique_id('t', xml_ids))
 		for i, (pitch, octv) in enumerate(tunings[args.tuning]):
-			course = ET.SubElement(tuning, uri_mei + 'course',
-								   **{f'{xml_id_key}': _add_unique_id('c', xml_ids)[-1]},
+			course = ET.SubElement(tuning, mei_tags.course,
+								   **{f'{xml_id_key}': _add_unique_id('c', xml_ids)},
 								   n=str(i+1),
 								   pname=pitch[0],
 								   oct=str(octv),
@@ -255,16 +346,16 @@ def handle_scoreDef(scoreDef: ET.Element, ns: dict, args: argparse.Namespace): #
 		staffGrp.remove(tab_staffDef)
 
 	# 2. Notehead <staffGrp>: create and set as first element in <staffGrp>
-	nh_staffGrp = ET.Element(uri_mei + 'staffGrp', 
-							 **{f'{xml_id_key}': _add_unique_id('sg', xml_ids)[-1]})
+	nh_staffGrp = ET.Element(mei_tags.staffGrp, 
+							 **{f'{xml_id_key}': _add_unique_id('sg', xml_ids)})
 	if args.staff == DOUBLE:
 		nh_staffGrp.set('symbol', 'bracket')
 		nh_staffGrp.set('bar.thru', 'true')
 	staffGrp.insert(0, nh_staffGrp)
 	# Add <staffDef>(s)
 	for i in [1] if args.staff == SINGLE else [1, 2]:
-		nh_staffDef = ET.SubElement(nh_staffGrp, uri_mei + 'staffDef',
-									**{f'{xml_id_key}': _add_unique_id('sd', xml_ids)[-1]},
+		nh_staffDef = ET.SubElement(nh_staffGrp, mei_tags.staffDef,
+									**{f'{xml_id_key}': _add_unique_id('sd', xml_ids)},
 									n=str(i),
 									lines='5'
 								   )
@@ -272,35 +363,31 @@ def handle_scoreDef(scoreDef: ET.Element, ns: dict, args: argparse.Namespace): #
 			nh_staffDef.set('dir.dist', '4')
 		# Add <clef>
 		if args.staff == SINGLE:
-			clef = _create_element(uri_mei + 'clef', 
+			clef = _create_element(mei_tags.clef, 
 								   parent=nh_staffDef, 
-								   atts=[(xml_id_key, _add_unique_id('c', xml_ids)[-1]),
+								   atts=[(xml_id_key, _add_unique_id('c', xml_ids)),
 								   		 ('shape', 'G'), 
 										 ('line', '2'),
 										 ('dis', '8'), 
 										 ('dis.place', 'below')]
 								  )
 		else:
-			clef = ET.SubElement(nh_staffDef, uri_mei + 'clef', 
-								 **{f'{xml_id_key}': _add_unique_id('c', xml_ids)[-1]},
+			clef = ET.SubElement(nh_staffDef, mei_tags.clef, 
+								 **{f'{xml_id_key}': _add_unique_id('c', xml_ids)},
 								 shape='G' if i==1 else 'F',
 								 line='2' if i==1 else '4'
 								)
 		# Add <keySig>
-		keySig = ET.SubElement(nh_staffDef, uri_mei + 'keySig',
-							   **{f'{xml_id_key}': _add_unique_id('ks', xml_ids)[-1]},
+		keySig = ET.SubElement(nh_staffDef, mei_tags.keySig,
+							   **{f'{xml_id_key}': _add_unique_id('ks', xml_ids)},
 							   sig=_get_MEI_keysig(int(args.key)),
 							   mode='minor' if args.mode == MINOR else 'major'
 							  )
 		# Add <meterSig> or <mensur>
 		if tab_meterSig is not None:
-			nh_meterSig = copy.deepcopy(tab_meterSig)
-			nh_meterSig.set(xml_id_key, _add_unique_id('ms', xml_ids)[-1])
-			nh_staffDef.append(nh_meterSig)
+			nh_staffDef.append(_clone_element(tab_meterSig, xml_id_key, 'ms'))
 		elif tab_mensur is not None:
-			nh_mensur = copy.deepcopy(tab_mensur)
-			nh_mensur.set(xml_id_key, _add_unique_id('m', xml_ids)[-1])
-			nh_staffDef.append(nh_mensur)
+			nh_staffDef.append(_clone_element(tab_mensur, xml_id_key, 'm'))
 
 
 def _get_MEI_keysig(key: int): # -> str:
@@ -339,158 +426,178 @@ def handle_section(section: ET.Element, ns: dict, args: argparse.Namespace): # -
 	the notehead notation, there is also a middle staff. 
 	"""
 
-	uri_mei = f'{{{ns['mei']}}}'
 	uri_xml = f'{{{ns['xml']}}}'
 	xml_id_key = f'{uri_xml}id'
+	_init_tags(ns['mei'])
 
-	grids_dict = _call_java(['java', '-cp', args.classpath, java_path, args.key, args.mode])
+	grids_dict = _get_grids(args.classpath, args.key, args.mode)
 	mpcGrid = grids_dict['mpcGrid'] # list
-	mpcGridStr = str(mpcGrid)
 	altGrid = grids_dict['altGrid'] # list
-	altGridStr = str(altGrid)
 	pcGrid = grids_dict['pcGrid'] # list
-	pcGridStr = str(pcGrid)
+	mpcGridStr, altGridStr, pcGridStr = _get_grid_strs(args.classpath, args.key, args.mode)
 
-	tab_notes_by_ID = {}
-	tabGrps_by_ID = {}
+	# Tab xml:id -> notehead xml:id (<tabGrp>: upper <chord>, <rest>, or <space>; 
+	# tab <note> or <rest>: <note> or upper <rest>)
+	nh_IDs_by_tabGrp_ID = {}
+	nh_IDs_by_tab_note_ID = {}
 
 	if add_accid_ges:
 		key_sig_accid_type = 'f' if int(args.key) <= 0 else 's'
 		# Key sig accidentals as MIDI pitch classes (e.g. 10, 3)
-		key_sig_accid_mpc = [mpcGrid[i] for i in range(len(altGrid)) if altGrid[i] == key_sig_accid_type]
+		key_sig_accid_mpc = frozenset(mpcGrid[i] for i in range(len(altGrid)) if altGrid[i] == key_sig_accid_type)
+
+	# MIDI pitch class -> pname and accidental attributes of the in-key note
+	in_key_spellings = {}
+	for i, mpc in enumerate(mpcGrid):
+		accid_ges = key_sig_accid_type if add_accid_ges and mpc in key_sig_accid_mpc else ''
+		in_key_spellings[mpc] = (pcGrid[i], [('accid.ges', accid_ges)] if accid_ges != '' else [])
 
-	for measure in section.iter(uri_mei + 'measure'):
+	xp_staff = _compile_path('mei:staff', ns['mei'])
+	xp_layer = _compile_path('mei:layer', ns['mei'])
+	regular_elements = frozenset([mei_tags.measure, mei_tags.staff, mei_tags.layer, mei_tags.tabGrp, 
+								  mei_tags.tabDurSym, mei_tags.note, mei_tags.rest])
+
+	for measure in section.iter(mei_tags.measure):
 		# 0. Collect any non-regular elements in <measure> and remove them from it
-		regular_elements = [uri_mei + t for t in ['measure', 'staff', 'layer', 'tabGrp', 'tabDurSym', 'note', 'rest']]
-		non_regular_elements = [elem for elem in measure.iter() if elem.tag not in regular_elements]
-		# Collect
-		elems_removed_from_measure = []
-		for elem in non_regular_elements:
-			# Get all elements with the same tag as elem
-			matching_elements = measure.findall(f'.//{elem.tag}', ns)
-			if matching_elements:
-				elems_removed_from_measure.extend(matching_elements)
+		# Collect (together with their parents; not descending into collected elements)
+		parents_and_elems_removed = []
+		stack = [(measure, child) for child in reversed(measure)]
+		while stack:
+			parent, elem = stack.pop()
+			tag = elem.tag
+			if tag not in regular_elements:
+				parents_and_elems_removed.append((parent, elem))
+			else:
+				stack.extend((elem, child) for child in reversed(elem))
 		# Remove
-		for elem in elems_removed_from_measure:
-			for parent in measure.iter():
-				if elem in parent:
-					parent.remove(elem)
-					break
+		for parent, elem in parents_and_elems_removed:
+			parent.remove(elem)
 
 		# 1. Handle regular <staff> elements
 		# a. Tablature <staff>
 		# Adapt
-		tab_staff = measure.find('mei:staff', ns)
-		tab_staff.set('n', str(int(tab_staff.attrib['n']) + (1 if args.staff == SINGLE else 2)))
-		tab_layer = tab_staff.find('mei:layer', ns)
+		tab_staff = xp_staff(measure)[0]
+		tab_layer = xp_layer(tab_staff)[0]
+		tab_staff.set('n', small_int_strs[int(tab_staff.attrib['n']) + (1 if args.staff == SINGLE else 2)])
 		# Remove
 		if args.tablature == NO:
 			measure.remove(tab_staff)
 
 		# b. Notehead <staff>s 
 		# Add <staff>s to <measure>
-		nh_staff_1 = ET.Element(uri_mei + 'staff', 
-								**{f'{xml_id_key}': _add_unique_id('s', xml_ids)[-1]},
+		nh_staff_1 = ET.Element(mei_tags.staff, 
+								**{f'{xml_id_key}': _add_unique_id('s', xml_ids)},
 								n='1')
-		nh_staff_2 = ET.Element(uri_mei + 'staff', 
-								**{f'{xml_id_key}': _add_unique_id('s', xml_ids)[-1]},
+		nh_staff_2 = ET.Element(mei_tags.staff, 
+								**{f'{xml_id_key}': _add_unique_id('s', xml_ids)},
 								n='2')
 		measure.insert(0, nh_staff_1)
 		if args.staff == DOUBLE:
 			measure.insert(1, nh_staff_2)
 
 		# Add <layer>s to <staff>s
-		nh_layer_1 = ET.SubElement(nh_staff_1, uri_mei + 'layer', 
-								   **{f'{xml_id_key}': _add_unique_id('l', xml_ids)[-1]},
+		nh_layer_1 = ET.SubElement(nh_staff_1, mei_tags.layer, 
+								   **{f'{xml_id_key}': _add_unique_id('l', xml_ids)},
 								   n='1')
-		nh_layer_2 = ET.SubElement(nh_staff_2, uri_mei + 'layer', 
-								   **{f'{xml_id_key}': _add_unique_id('l', xml_ids)[-1]},
+		nh_layer_2 = ET.SubElement(nh_staff_2, mei_tags.layer, 
+								   **{f'{xml_id_key}': _add_unique_id('l', xml_ids)},
 								   n='1')
 
 		# Add <rest>s, and <chord>s and/or<space>s to <layer>s; collect <dir>s
 		dirs = []
 		accidsInEffect = [[], [], [], [], []] # double flats, flats, naturals, sharps, double sharps
-		for tabGrp in tab_layer.iter(uri_mei + 'tabGrp'):
+		# Only recomputed after a spelling call
+		accidsInEffectStr = str(accidsInEffect)
+		anyAccidsInEffect = False
+		for tabGrp in tab_layer.iter(mei_tags.tabGrp):
 			dur = tabGrp.get('dur')
 			dots = tabGrp.get('dots')
-			flag = tabGrp.find('mei:tabDurSym', ns)
-			rest = tabGrp.find('mei:rest', ns)
-			space = tabGrp.find('mei:space', ns)
 			xml_id_tabGrp = tabGrp.get(xml_id_key)
+			# Sort the <tabGrp>'s children
+			flag, rest, space = None, None, None
+			tab_notes = []
+			for element in tabGrp:
+				tag = element.tag
+				if tag == mei_tags.tabDurSym and flag is None:
+					flag = element
+				elif tag == mei_tags.rest and rest is None:
+					rest = element
+				elif tag == mei_tags.space and space is None:
+					space = element
+				else:
+					tab_notes.append(element)
 
 			# Add <rest>s. Rests can be implicit (a <tabGrp> w/ only a <tabDurSym>) or
 			# explicit (a <tabGrp> w/ a <rest> (and possibly a <tabDurSym>)). Both are
 			# transcribed as a <rest> in the CMN
-			if (flag != None and (len(tabGrp) == 1) or rest != None): # or space != None):
-				xml_id_rest_1 = _add_unique_id('r', xml_ids)[-1]
-				xml_id_rest_2 = _add_unique_id('r', xml_ids)[-1]
+			if rest is not None or (flag is not None and len(tabGrp) == 1): # or space is not None:
+				xml_id_rest_1 = _add_unique_id('r', xml_ids)
+				xml_id_rest_2 = _add_unique_id('r', xml_ids)
 
 				# 1. Add <rest>s to <layer>s
-				rest_1 = _create_element(uri_mei + 'rest', 
-										 parent=nh_layer_1, 
-										 atts=[(xml_id_key, xml_id_rest_1),
-										 	   ('dur', dur)]
-										)
-				rest_2 = _create_element(uri_mei + 'rest', 
-										 parent=nh_layer_2, 
-										 atts=[(xml_id_key, xml_id_rest_2),
-										 	   ('dur', dur)]
-										)
+				_create_element(mei_tags.rest, 
+								parent=nh_layer_1, 
+								atts=[(xml_id_key, xml_id_rest_1),
+									  ('dur', dur)]
+							   )
+				_create_element(mei_tags.rest, 
+								parent=nh_layer_2, 
+								atts=[(xml_id_key, xml_id_rest_2),
+									  ('dur', dur)]
+							   )
 
 				# 2. Add <dir>
-				dirs.append(_make_dir(xml_id_rest_1, dur, dots, ns))
+				dirs.append(_make_dir(xml_id_rest_1, dur, dots, xml_id_key))
 
 				# 3. Map tabGrp
-				rests = (rest_1, None) if args.staff == SINGLE else (rest_1, rest_2)
-				tabGrps_by_ID[xml_id_tabGrp] = (tabGrp, rests)
+				nh_IDs_by_tabGrp_ID[xml_id_tabGrp] = xml_id_rest_1
 				# Map tab <rest>
-				if rest != None:
-					tab_notes_by_ID[rest.get(xml_id_key)] = (rest, rests) 
+				if rest is not None:
+					nh_IDs_by_tab_note_ID[rest.get(xml_id_key)] = xml_id_rest_1
 
 			# Add <chord>s and/or <space>s	
 			else:
 				# 0. Create <chord>s and add <note>s to them
 				# NB A <chord> cannot be added directly to the parent <layer> upon creation 
 				#    because it may remain empty, and in that case must be replaced by a <space>
-				xml_id_chord_1 = _add_unique_id('c', xml_ids)[-1]
-				xml_id_chord_2 = _add_unique_id('c', xml_ids)[-1]
-				chord_1 = _create_element(uri_mei + 'chord', 
+				xml_id_chord_1 = _add_unique_id('c', xml_ids)
+				xml_id_chord_2 = _add_unique_id('c', xml_ids)
+				chord_1 = _create_element(mei_tags.chord, 
 										  atts=[(xml_id_key, xml_id_chord_1),
 										   		('dur', dur), 
 										   		('stem.visible', 'false')]
 										 )
-				chord_2 = _create_element(uri_mei + 'chord', 
+				chord_2 = _create_element(mei_tags.chord, 
 										  atts=[(xml_id_key, xml_id_chord_2),
 										   		('dur', dur), 
 										   		('stem.visible', 'false')]
 										 )
-				for element in tabGrp:
-					if element != flag and element != rest and element != space:
-						try:
-							midi_pitch = _get_midi_pitch(int(element.get('tab.course')), 
-													 	 int(element.get('tab.fret')), 
-													 	 args.tuning)
-						except TypeError:
-							raise Exception(f"Element {element.tag} with attributes\
-											{element.attrib} is either missing tab.course or tab.fret")
-
-						midi_pitch_class = midi_pitch % 12
-						# a. The note is in key	and there are no accidentals in effect
-						if midi_pitch_class in mpcGrid and not any(accidsInEffect):
-							pname = pcGrid[mpcGrid.index(midi_pitch_class)]
-							accid = ''									
-							if add_accid_ges:
-								accid_ges = key_sig_accid_type if midi_pitch_class in key_sig_accid_mpc else ''
-						# b. The note is in key	and there are accidentals in effect / the note is not in key
-						else:
-							cmd = ['java', '-cp', args.classpath, java_path, str(midi_pitch), args.key,
-				 	 			   mpcGridStr, altGridStr, pcGridStr, str(accidsInEffect)]
-							spell_dict = _call_java(cmd)
-							pname = spell_dict['pname'] # str
-							accid = spell_dict['accid'] # str
-							if add_accid_ges:
-								accid_ges = spell_dict['accid.ges'] # str
-							accidsInEffect = spell_dict['accidsInEffect'] # list
+				# Whether the <chord>s have any <note>s
+				chord_1_filled, chord_2_filled = False, False
+				for element in tab_notes:
+					try:
+						midi_pitch = _get_midi_pitch(int(element.get('tab.course')), 
+												 	 int(element.get('tab.fret')), 
+												 	 args.tuning)
+					except TypeError:
+						raise Exception(f"Element {element.tag} with attributes\
+										{element.attrib} is either missing tab.course or tab.fret")
+
+					midi_pitch_class = midi_pitch % 12
+					# a. The note is in key	and there are no accidentals in effect
+					if not anyAccidsInEffect and midi_pitch_class in in_key_spellings:
+						pname, accid_part = in_key_spellings[midi_pitch_class]
+					# b. The note is in key	and there are accidentals in effect / the note is not in key
+					else:
+						spell_dict = _spell_pitch(args.classpath, small_int_strs[midi_pitch], args.key,
+												  mpcGridStr, altGridStr, pcGridStr, accidsInEffectStr)
+						pname = spell_dict['pname'] # str
+						accid = spell_dict['accid'] # str
+						if add_accid_ges:
+							accid_ges = spell_dict['accid.ges'] # str
+						accidsInEffect = spell_dict['accidsInEffect'] # list
+						accidsInEffectStr = str(accidsInEffect)
+						anyAccidsInEffect = any(accidsInEffect)
 
 						accid_part = [('accid', accid)] if accid != '' else []
 						if add_accid_ges:
@@ -498,89 +605,106 @@ def handle_section(section: ET.Element, ns: dict, args: argparse.Namespace): # -
 							if accid_ges != '':
 								accid_part = [('accid.ges', accid_ges)]
 
-						xml_id_note = _add_unique_id('n', xml_ids)[-1]
-						nh_note = _create_element(uri_mei + 'note', 
-												  parent=chord_1 if args.staff == SINGLE else\
-												         (chord_1 if midi_pitch >= 60 else chord_2), 
-												  atts=[(xml_id_key, xml_id_note),
-												  		('pname', pname),
-												        ('oct', str(_get_octave(midi_pitch))),
-												   		('head.fill', 'solid')] + (accid_part)
-											 	 )
-						# Map tab <note>
-						tab_notes_by_ID[element.get(xml_id_key)] = (element, nh_note)
+					xml_id_note = _add_unique_id('n', xml_ids)
+					in_chord_1 = args.staff == SINGLE or midi_pitch >= 60
+					if in_chord_1:
+						chord_1_filled = True
+					else:
+						chord_2_filled = True
+					_create_element(mei_tags.note, 
+									parent=chord_1 if in_chord_1 else chord_2, 
+									atts=[(xml_id_key, xml_id_note),
+										  ('pname', pname),
+										  ('oct', oct_strs[midi_pitch]),
+										  ('head.fill', 'solid')] + (accid_part)
+								   )
+					# Map tab <note>
+					nh_IDs_by_tab_note_ID[element.get(xml_id_key)] = xml_id_note
 
 				# 1. Add <chord>s and/or <space>s to <layer>s
-				nh_layer_1.append(chord_1 if len(chord_1) > 0 else space)
+				nh_layer_1.append(chord_1 if chord_1_filled else space)
 				if args.staff == DOUBLE:
-					xml_id_space = _add_unique_id('s', xml_ids)[-1]
-					space = _create_element(uri_mei + 'space', 
+					xml_id_space = _add_unique_id('s', xml_ids)
+					space = _create_element(mei_tags.space, 
 											atts=[(xml_id_key, xml_id_space),
 											 	  ('dur', dur)]
 											)
-					nh_layer_2.append(chord_2 if len(chord_2) > 0 else space)
-				xml_id_reference = xml_id_chord_1 if len(chord_1) > 0 else xml_id_space
+					nh_layer_2.append(chord_2 if chord_2_filled else space)
+				xml_id_reference = xml_id_chord_1 if chord_1_filled else xml_id_space
 
 				# 2. Add <dir>
-				if flag != None:
-					dirs.append(_make_dir(xml_id_reference, dur, dots, ns))
+				if flag is not None:
+					dirs.append(_make_dir(xml_id_reference, dur, dots, xml_id_key))
 
 				# 3. Map tabGrp
-				chords = (chord_1, None) if args.staff == SINGLE\
-										 else (chord_1 if len(chord_1) > 0 else space,\
-										 	   chord_2 if len(chord_2) > 0 else space)
-				tabGrps_by_ID[xml_id_tabGrp] = (tabGrp, chords)
+				nh_IDs_by_tabGrp_ID[xml_id_tabGrp] = xml_id_chord_1 if args.staff == SINGLE else xml_id_reference
 
 		# 2. Handle non-regular <measure> elements. These are elements that require <chord>, 
 		#    <rest>, or <space> reference xml:ids, and must therefore be handled after all 
 		#    regular <staff> elements are handled, and those reference IDs all exist
-		curr_non_regular_elements = []
-		for c in elems_removed_from_measure:
+		fermatas, annots, fings = [], [], []
+		for _, c in parents_and_elems_removed:
+			tag = c.tag
 			# Fermata: needs <dir> (CMN) and <fermata> (= c; tab)
-			if c.tag == uri_mei + 'fermata':
+			if tag == mei_tags.fermata:
 				# Make <dir> for CMN and add 
 				xml_id_tabGrp = c.get('startid')[1:] # start after '#'
-				xml_id_upper_chord = tabGrps_by_ID[xml_id_tabGrp][1][0].get(xml_id_key)
-				dirs.append(_make_dir(xml_id_upper_chord, 'f', None, ns))
+				xml_id_upper_chord = nh_IDs_by_tabGrp_ID[xml_id_tabGrp]
+				dirs.append(_make_dir(xml_id_upper_chord, 'f', None, xml_id_key))
 
 				# Add to list	
 				if args.tablature == YES:
-					curr_non_regular_elements.append(c)
+					fermatas.append(c)
 			# Annotation: needs <annot> (CMN) and <annot> (= c; tab) 
-			elif c.tag == uri_mei + 'annot':
+			elif tag == mei_tags.annot:
 				# Make <annot> for CMN
 				xml_id_tab_note = c.get('plist')[1:] # start after '#'
-				xml_id_note = tab_notes_by_ID[xml_id_tab_note][1].get(xml_id_key)
-				annot = copy.deepcopy(c)
+				xml_id_note = nh_IDs_by_tab_note_ID[xml_id_tab_note]
+				annot = _clone_element(c, xml_id_key, 'a')
 				annot.set('plist', '#' + xml_id_note)
-				annot.set(xml_id_key, _add_unique_id('a', xml_ids)[-1])
 
 				# Add to list
-				curr_non_regular_elements.append(annot)
+				annots.append(annot)
 				if args.tablature == YES:
-					curr_non_regular_elements.append(c)
+					annots.append(c)
 			# Fingering: needs <fing> (= c; tab)
-			elif c.tag == uri_mei + 'fing':
+			elif tag == mei_tags.fing:
 				# Add to list
 				if args.tablature == YES:
-					curr_non_regular_elements.append(c)
+					fings.append(c)
 
 		# 3. Add non-regular <measure> elements to completed <measure> in fixed sequence
-		fermatas = [e for e in curr_non_regular_elements if e.tag == uri_mei + 'fermata']
-		annots = [e for e in curr_non_regular_elements if e.tag == uri_mei + 'annot']
-		fings = [e for e in curr_non_regular_elements if e.tag == uri_mei + 'fing']
-		for e in dirs + fermatas + annots + fings:
-			measure.append(e)
-
-		if verbose:
-			for elem in measure:
-				print(elem.tag, elem.attrib)
-				for e in elem:
-					print(e.tag, e.attrib)
-					for ee in e:
-						print(ee.tag, ee.attrib)
-						for eee in ee:
-							print(eee.tag, eee.attrib)
+		for elems in (dirs, fermatas, annots, fings):
+			measure.extend(elems)
+
+	# Dump the completed <section> (debug logging only; see verbose)
+	if logger.isEnabledFor(logging.DEBUG):
+		logger.debug(ET.tostring(section, encoding='unicode'))
+
+
+# Cached per key and mode. NB The returned dict is shared and must not be modified 
+@lru_cache(maxsize=32)
+def _get_grids(classpath: str, key: str, mode: str): # -> dict:
+	return _call_java(_java_cmd(classpath, key, mode))
+
+
+# The grids as passed to Java for each spelling call
+@lru_cache(maxsize=32)
+def _get_grid_strs(classpath: str, key: str, mode: str): # -> tuple:
+	grids_dict = _get_grids(classpath, key, mode)
+	return (str(grids_dict['mpcGrid']), str(grids_dict['altGrid']), str(grids_dict['pcGrid']))
+
+
+# Cached per arguments. NB The returned dict is shared and must not be modified
+@lru_cache(maxsize=None)
+def _spell_pitch(classpath: str, midi_pitch: str, key: str, mpcGridStr: str, altGridStr: str, 
+				 pcGridStr: str, accidsInEffectStr: str): # -> dict:
+	return _call_java(_java_cmd(classpath, midi_pitch, key, mpcGridStr, altGridStr, pcGridStr, 
+								accidsInEffectStr))
+
+
+def _java_cmd(classpath: str, *java_args: str): # -> list:
+	return ['java', *java_opts, '-cp', classpath, java_path, *java_args]
 
 
 # NB For debugging: set, where this function is called, use_Popen=True
@@ -602,52 +726,37 @@ def _call_java(cmd: list, use_Popen: bool=False): # -> dict:
 	return json.loads(outp)
 
 
-def _make_dir(xml_id: str, dur: int, dots: int, ns: dict): # -> 'ET.Element'
-	uri_mei = f'{{{ns['mei']}}}'
-	uri_xml = f'{{{ns['xml']}}}'
-	xml_id_key = f'{uri_xml}id'
-
-	d = ET.Element(uri_mei + 'dir', 
-				   **{f'{xml_id_key}': _add_unique_id('d', xml_ids)[-1]},
-				   place='above', 
-				   startid='#' + xml_id
-				  )
+def _make_dir(xml_id: str, dur: str, dots: str, xml_id_key: str): # -> 'ET.Element'
+	d = ET.Element(mei_tags.dir, {xml_id_key: _add_unique_id('d', xml_ids),
+								  'place': 'above',
+								  'startid': '#' + xml_id})
 	
-	# Non-fermata case
-	if dur != 'f':
-		_create_element(uri_mei + 'symbol', 
-						parent=d, 
-						atts=[(xml_id_key, _add_unique_id('s', xml_ids)[-1]),
-							  ('glyph.auth', 'smufl'), 
-							  ('glyph.name', smufl_lute_durs[int(dur)])]
-				   	   )
-		if dots != None:
-			_create_element(uri_mei + 'symbol', 
-							parent=d, 
-							atts=[(xml_id_key, _add_unique_id('s', xml_ids)[-1]),
-								  ('glyph.auth', 'smufl'), 
-							 	  ('glyph.name', smufl_lute_durs['.'])]
-						   )
-	# Fermata case 
-	else:
-		_create_element(uri_mei + 'symbol', 
-						parent=d, 
-						atts=[(xml_id_key, _add_unique_id('s', xml_ids)[-1]),
-							  ('glyph.auth', 'smufl'), 
-						 	  ('glyph.name', smufl_lute_durs['f'])]
-				   	   )
+	# Rhythm symbol or fermata
+	ET.SubElement(d, mei_tags.symbol, {xml_id_key: _add_unique_id('s', xml_ids),
+									   'glyph.auth': 'smufl',
+									   'glyph.name': smufl_lute_durs_by_dur[dur]})
+	# Dot
+	if dots is not None:
+		ET.SubElement(d, mei_tags.symbol, {xml_id_key: _add_unique_id('s', xml_ids),
+										   'glyph.auth': 'smufl',
+										   'glyph.name': smufl_lute_durs['.']})
 
 	return d
 
 
-def _get_midi_pitch(course: int, fret: int, tuning: str): # -> int:
+def _get_open_courses(tuning: str): # -> tuple:
 	# Determine the MIDI pitches for the open courses
 	abzug = 0 if not '-' in tuning else 2
-	open_courses = [67, 62, 57, 53, 48, (43 - abzug)]
-	if tuning[0] != 'G':
-		shift_interv = shift_intervals[tuning[0]]
-		open_courses = list(map(lambda x: x+shift_interv, open_courses))
-	return open_courses[course-1] + fret
+	shift_interv = 0 if tuning[0] == 'G' else shift_intervals[tuning[0]]
+	return tuple(x + shift_interv for x in (67, 62, 57, 53, 48, (43 - abzug)))
+
+
+# Open courses per tuning
+open_courses_by_tuning = {t: _get_open_courses(t) for t in tunings}
+
+
+def _get_midi_pitch(course: int, fret: int, tuning: str): # -> int:
+	return open_courses_by_tuning[tuning][course-1] + fret
 
 
 def _get_octave(midi_pitch: int): # -> int:
@@ -655,56 +764,80 @@ def _get_octave(midi_pitch: int): # -> int:
 	return int((c / 12) - 1)
 
 
+# MIDI pitch -> its octave as an attribute value
+oct_strs = tuple(small_int_strs[_get_octave(p)] for p in range(128))
+
+
 def transcribe(infiles: list, arg_paths: dict, args: argparse.Namespace): # -> None
+	# Batch of files: process pool; single file: this process
+	# NB With verbose, batches are also run in this process: logging is only configured 
+	#    in transcriber.py's __main__, which pool workers started with spawn (the default 
+	#    on macOS and Windows) do not run, so they would drop the debug output
+	if len(infiles) > 1 and not verbose:
+		nproc = os.cpu_count() or 1
+		chunksize = max(1, len(infiles) // (4 * nproc))
+		# Consume the results (re-raises any exception from a worker)
+		list(_get_executor().map(_transcribe_one, infiles, repeat(arg_paths), repeat(args), 
+								 chunksize=chunksize))
+	else:
+		for infile in infiles:
+			_transcribe_one(infile, arg_paths, args)
+
+
+def _get_executor(): # -> ProcessPoolExecutor
+	# Created on first use
+	global executor
+	if executor is None:
+		# NB The default max_workers is the CPU count (capped at 61 on Windows)
+		executor = ProcessPoolExecutor()
+
+	return executor
+
+
+def _transcribe_one(infile: str, arg_paths: dict, args: argparse.Namespace): # -> None
 	inpath = arg_paths['inpath']
 	outpath = arg_paths['outpath']
 
-	for infile in infiles:
-		filename, ext = os.path.splitext(os.path.basename(infile)) # input file name, extension
-		outfile = filename + '-dipl' + ext # output file
+	filename, ext = os.path.splitext(os.path.basename(infile)) # input file name, extension
+	outfile = filename + '-dipl' + ext # output file
 
-		xml_file = os.path.join(inpath, infile)
+	xml_file = os.path.join(inpath, infile)
 
-		# Manually extract processing instructions (PIs): <?xml> declaration and <?xml-model> PI 
-		with open(xml_file, 'r', encoding='utf-8') as file:
-			content = file.read()
-			lines = content.split('\n')
-			declaration = lines[0] + '\n'
-			if lines[1][1:].startswith('?xml-model'):
-				model_pi = lines[1] + '\n'
-			else:
-				model_pi = ''
+	# Manually extract processing instructions (PIs): <?xml> declaration and <?xml-model> PIs
+	with open(xml_file, 'r', encoding='utf-8') as file:
+		prolog = ''.join(takewhile(lambda line: line.lstrip('\ufeff').lstrip().startswith('<?'), file))
+	declaration, model_pi = (g or '' for g in prolog_pattern.match(prolog).groups())
 
-		# Handle namespaces
-		ns = handle_namespaces(xml_file)
-		uri = '{' + ns['mei'] + '}'
+	# Get the root and tree; handle namespaces
+	tree, mei, ns_nodes = parse_tree(xml_file)
+	ns = handle_namespaces(ns_nodes)
 
-		# Get the root, tree, and main MEI elements (<meiHead> and <music>);
-		# collect all xml:ids
-		tree, mei = parse_tree(xml_file)
-		meiHead = mei.find('mei:meiHead', ns)
-		music = mei.find('mei:music', ns)
+	# Get the main MEI element (<music>); collect all xml:ids
+	music = _compile_path('mei:music', ns['mei'])(mei)[0]
+	global xml_ids
+	if LXML:
+		xml_ids = set(mei.xpath('//@xml:id', smart_strings=False))
+	else:
 		xml_id = f"{{{ns['xml']}}}id"
-		global xml_ids
-		xml_ids = [elem.attrib[xml_id] for elem in mei.iter() if xml_id in elem.attrib]
+		xml_ids = {v for elem in mei.iter() if (v := elem.get(xml_id)) is not None}
 
-		# Handle <scoreDef>
-		score = music.findall('.//' + uri + 'score')[0]
-		scoreDef = score.find('mei:scoreDef', ns)
-		handle_scoreDef(scoreDef, ns, args)
+	# Handle <scoreDef>
+	score = _compile_path('.//mei:score', ns['mei'])(music)[0]
+	scoreDef = _compile_path('mei:scoreDef', ns['mei'])(score)[0]
+	handle_scoreDef(scoreDef, ns, args)
 
-		# Handle <section>
-		section = score.find('mei:section', ns)
-		handle_section(section, ns, args)
+	# Handle <section>
+	section = _compile_path('mei:section', ns['mei'])(score)[0]
+	handle_section(section, ns, args)
 
-		# Fix indentation
-		ET.indent(tree, space='\t', level=0)
+	# Fix indentation
+	ET.indent(tree, space='\t', level=0)
 
-#		# Write to file
-#		tree.write(os.path.join(outpath, outfile))
+#	# Write to file
+#	tree.write(os.path.join(outpath, outfile))
 
-		# Prepend declaration and processing instructions
-		xml_str = ET.tostring(tree.getroot(), encoding='unicode')
-		xml_str = f'{declaration}{model_pi}{xml_str}'
-		with open(os.path.join(outpath, outfile), 'w', encoding='utf-8') as file:
-			file.write(xml_str)
\ No newline at end of file
+	# Prepend declaration and processing instructions
+	xml_str = ET.tostring(tree.getroot(), encoding='unicode')
+	xml_str = f'{declaration}{model_pi}{xml_str}'
+	with open(os.path.join(outpath, outfile), 'w', encoding='utf-8') as file:
+		file.write(xml_str)
\ No newline at end of file
@@ -10,6 +10,9 @@ contains the following subfolders:
 
 NB: Updated from Python 3.6.0 to 3.12.0 for this script.
 
+Optional: lxml (https://lxml.de/) is used for the XML handling if it is installed 
+(recommended, as it is faster); otherwise, the standard library's ElementTree is used.
+
 Relevant Python documentation
 - https://docs.python.org/3/library/argparse.html
 
@@ -24,8 +27,8 @@ TODO
 """
 
 import argparse
-import glob
 import json
+import logging
 import os
 import re
 import sys
@@ -86,6 +89,7 @@ parser.add_argument('classpath',
 args = parser.parse_args()
 
 if __name__ == "__main__":
+	logging.basicConfig(format='%(message)s')
 #	scriptpath = os.getcwd() # full path to script
 
 	# Paths
@@ -111,10 +115,10 @@ if __name__ == "__main__":
 		infiles.append(infile)
 	# All files in in_path folder
 	else:
-		for ext in ['.mei', '.xml']:
-			pattern = os.path.join(in_path, f'*{ext}')
-			infiles.extend(glob.glob(pattern))
-		infiles = [os.path.basename(f) for f in infiles]
+		# Skip hidden files (e.g., macOS '._' files)
+		with os.scandir(in_path) as entries:
+			infiles = [e.name for e in entries if not e.name.startswith('.') and e.is_file() and 
+					   os.path.splitext(os.path.normcase(e.name))[1] in ('.mei', '.xml')]
 
 #	print("FILES", infiles)
 #	print(scriptpath)